@@ -31,9 +31,63 @@ import yaml
 import argparse
 import os
 import re
+import pickle
+import hashlib
+import tempfile
 from datetime import date
+from functools import reduce
+from operator import getitem
 import logging
 
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+# Directory owned by this tool where parsed CWL templates are cached
+TEMPLATE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.template_cache')
+
+
+class NoAliasDumper(SafeDumper):
+    """
+    YAML dumper that writes shared objects (e.g. an input default used in both the workflow and process inputs)
+    in full rather than as anchors and aliases.
+    """
+    def ignore_aliases(self, data):
+        return True
+
+
+# Mapping of YML input file fields to OGC and CWL generic fields
+OGC_CWL_KEY_MAP = {
+    "algorithm_description": (("$graph", 0, "doc"),),
+    "algorithm_name": (("$graph", 0, "label"), ("$graph", 0, "id")),
+    "algorithm_version": (("s:version",),),
+    "author": (("s:author", 0, "s:name"),),
+    "citation": (("s:citation",),),
+    "code_repository": (("s:codeRepository",),),
+    "contributor": (("s:contributor", 0, "s:name"),),
+    "cores_min": (("$graph", 1, "requirements", "ResourceRequirement", "coresMin"),),
+    "keywords": (("s:keywords",),),
+    "license": (("s:license",),),
+    "outdir_max": (("$graph", 1, "requirements", "ResourceRequirement", "outdirMax"),),
+    "ram_min": (("$graph", 1, "requirements", "ResourceRequirement", "ramMin"),),
+    "release_notes": (("s:releaseNotes",),),
+    "run_command": (("$graph", 1, "baseCommand"),)
+}
+
+_VERSION_SANITIZE_RE = re.compile(r'[^a-zA-Z0-9 ]')
+
+# Formatters for OGC CWL fields that require a specific value format, keyed on the field name
+_VALUE_PROCESSORS = {
+    "s:version": lambda value: _VERSION_SANITIZE_RE.sub('_', str(value)),
+}
+
+# Builders for input types whose default must be given as a CWL object, keyed on the input type
+_INPUT_DEFAULT_BUILDERS = {
+    "Directory": lambda input_default: {"class": "Directory", "path": input_default},
+    "File": lambda input_default: {"class": "File", "path": input_default},
+}
+
 
 def process_value(target, value):
     """
@@ -46,48 +100,82 @@ def process_value(target, value):
     Returns:
         str: Processed algorithm config value.
     """
-    match target[-1]:
-        case "s:version":
-            return re.sub(r'[^a-zA-Z0-9 ]', '_', str(value))
-        case _:
-            return value
+    processor = _VALUE_PROCESSORS.get(target[-1])
+    return value if processor is None else processor(value)
 
 
-def set_path_value(workflow, path, value):
+def add_input_default(input_type, input_default):
     """
-    Assign value at given path within workflow template.
+    Add default value for input.
 
     Args:
-        workflow (dict): The workflow template (nested dictionary) where the value will be set.
-        path (list): A list of keys that specifies the location within the workflow template where the value should be assigned.
-        value: Value to assign to the specified path in the workflow template.
+        input_type (str): The type of the input (e.g. "Directory", "string").
+        input_default (str): The default value to assign to the input.
 
     Returns:
-        None
+        dict or str: Returns a dict for special types and a string for primitive types.
     """
-    for key in path[:-1]:
-        workflow = workflow[key]
-    workflow[path[-1]] = value
+    builder = _INPUT_DEFAULT_BUILDERS.get(input_type)
+    return input_default if builder is None else builder(input_default)
 
 
-def add_input_default(input_type, input_default):
+def load_template(template_file):
     """
-    Add default value for input.
+    Load CWL template file, reusing a pickled copy of the parsed template when the template is unchanged.
+
+    Parsed templates are cached under TEMPLATE_CACHE_DIR, a directory owned by this tool, rather than next to the
+    template, since loading a pickle can execute arbitrary code. Each cache entry records the template's size and
+    nanosecond mtime and is only reused if both still match, and is prefixed with a SHA-256 digest of the pickle so
+    corruption is detected before unpickling. The cache is best-effort: an unreadable, corrupt or stale cache is
+    treated as a miss.
 
     Args:
-        input_type (str): The type of the input (e.g. "Directory", "string").
-        input_default (str): The default value to assign to the input.
+        template_file (str): Path to CWL template file.
 
     Returns:
-        dict or str: Returns a dict for special types and a string for primitive types.
+        dict: Parsed CWL template.
     """
-    match input_type:
-        case "Directory" | "File":
-            return {"class": input_type, "path": input_default}
-        case _:
-            return input_default
-        
-            
+    cache_name = hashlib.sha256(os.path.abspath(template_file).encode('utf-8')).hexdigest()
+    cache_path = os.path.join(TEMPLATE_CACHE_DIR, f"{cache_name}.pkl")
+
+    template_stat = os.stat(template_file)
+    template_key = (template_stat.st_mtime_ns, template_stat.st_size)
+
+    try:
+        with open(cache_path, 'rb') as f:
+            digest = f.read(hashlib.sha256().digest_size)
+            payload = f.read()
+        if hashlib.sha256(payload).digest() != digest:
+            raise ValueError("checksum mismatch")
+        cached_key, cached_workflow = pickle.loads(payload)
+        if cached_key == template_key:
+            return cached_workflow
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.warning(f'Ignoring unreadable CWL template cache `{cache_path}`: {e}')
+
+    with open(template_file, 'rb') as f:
+        workflow = yaml.load(f, Loader=SafeLoader)
+
+    # Write to a temporary file and move it into place so an interrupted or concurrent write never leaves a
+    # partial cache behind
+    tmp_path = None
+    try:
+        os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile('wb', dir=TEMPLATE_CACHE_DIR, suffix='.tmp', delete=False) as f:
+            tmp_path = f.name
+            payload = pickle.dumps((template_key, workflow), protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(hashlib.sha256(payload).digest())
+            f.write(payload)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        logging.warning(f'Unable to cache CWL template to `{cache_path}`: {e}')
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return workflow
+
 
 def yaml_to_cwl(yaml_file, workflow_output_dir, template_file):
     """
@@ -101,17 +189,23 @@ def yaml_to_cwl(yaml_file, workflow_output_dir, template_file):
     Return:
         None
     """
+    # Read environment set by the GitHub action
+    docker_tag = os.getenv('DOCKER_TAG')
+    commit_hash = os.getenv('GIT_COMMIT_HASH')
+    workflow_filename = os.getenv('WORKFLOW_FILE_NAME', 'process.cwl')
+
+    if docker_tag is None:
+        logging.warning("Environment variable `DOCKER_TAG` is not set. The workflow's DockerRequirement will be empty.")
+
     # Load workflow configuration YML file
-    with open(yaml_file, 'r') as f:
-        config = yaml.safe_load(f)
+    with open(yaml_file, 'rb') as f:
+        config = yaml.load(f, Loader=SafeLoader)
 
     # Load CWL template file
-    with open(template_file, 'r') as f:
-        workflow = yaml.safe_load(f)
+    workflow = load_template(template_file)
 
     # Create output directory if nonexistent
-    if not os.path.exists(workflow_output_dir):
-        os.makedirs(workflow_output_dir)
+    os.makedirs(workflow_output_dir, exist_ok=True)
 
 
     # Attempt to retrieve information required to be compliant with OGC and CWL v1.2 best practices
@@ -119,53 +213,37 @@ def yaml_to_cwl(yaml_file, workflow_output_dir, template_file):
     # See CWL v1.2 docs here: https://www.commonwl.org/v1.2/Workflow.html#Workflow 
     # See OGC docs here: https://docs.ogc.org/bp/20-089r1.html#toc24
     
-    # Define mapping of YML input file fields to OGC and CWL generic fields
-    OGC_CWL_KEY_MAP = {
-                "algorithm_description": [("$graph", 0, "doc")],
-                "algorithm_name": [("$graph", 0, "label"), ("$graph", 0, "id")],
-                "algorithm_version": [("s:version",)],
-                "author": [("s:author", 0, "s:name")],
-                "citation": [("s:citation",)],
-                "code_repository": [("s:codeRepository",)],
-                "contributor": [("s:contributor", 0, "s:name")],
-                "cores_min": [("$graph", 1, "requirements", "ResourceRequirement", "coresMin")],
-                "keywords": [("s:keywords",)],
-                "license": [("s:license",)],
-                "outdir_max": [("$graph", 1, "requirements", "ResourceRequirement", "outdirMax")],
-                "ram_min": [("$graph", 1, "requirements", "ResourceRequirement", "ramMin")],
-                "release_notes": [("s:releaseNotes",)],
-                "run_command": [("$graph", 1, "baseCommand")]
-              }
-    
-    for key in OGC_CWL_KEY_MAP:
-        targets = OGC_CWL_KEY_MAP[key]
-        if key in config:
-            for target in targets:
-                value = process_value(target, config[key])
-                set_path_value(workflow, target, value)
-        else:
-            logging.warning(f'Expected key `{key}` not found in algorithm config.')
+    for key, value in config.items():
+        targets = OGC_CWL_KEY_MAP.get(key)
+        if targets is None:
+            continue
+        for target in targets:
+            reduce(getitem, target[:-1], workflow)[target[-1]] = process_value(target, value)
+
+    missing_keys = [key for key in OGC_CWL_KEY_MAP if key not in config]
+    if missing_keys:
+        logging.warning("Expected keys not found in algorithm config: %s", ", ".join(missing_keys))
 
 
     # Handle inputs and outputs separately since the same information is used in
     # slightly different formats across several different fields.
-    workflow_inputs = []
-    step_inputs = []
-    process_inputs = []
+    workflow_inputs = {}
+    step_inputs = {}
+    process_inputs = {}
     
-    workflow_outputs = []
+    workflow_outputs = {}
     step_outputs = []
-    process_outputs = []
+    process_outputs = {}
 
     input_param_names = set()
 
-    for input in config.get("inputs", []):
+    for position, input in enumerate(config.get("inputs", []), start=1):
         input_name = input.get("name")
 
         # Check for input parameter name uniqueness
-        if input_name not in input_param_names:
-            input_param_names.add(input_name)
-        else:
+        prev_len = len(input_param_names)
+        input_param_names.add(input_name)
+        if len(input_param_names) == prev_len:
             raise ValueError(f"Duplicate input parameter name '{input_name}'. Input parameters must be unique.")
 
         input_type = input.get("type")
@@ -177,36 +255,29 @@ def yaml_to_cwl(yaml_file, workflow_output_dir, template_file):
             logging.warning("Expected both input type and input name to be provided for input.")
         
         # Workflow inputs
-        workflow_tmp = {input_name: {
+        workflow_input = workflow_inputs[input_name] = {
             "doc": input_doc,
             "label": input_label,
             "type": input_type
-        }}
-        workflow_inputs.append(workflow_tmp)
+        }
 
         # Process inputs
-        process_tmp = {input_name: {
+        process_input = process_inputs[input_name] = {
             "type": input_type,
             "inputBinding": {
-                "position": len(process_inputs) + 1,
+                "position": position,
                 "prefix": f"--{input_name}"
-        }}}
+            }
+        }
         
         # If default value was provided, add that in
         if input_default is not None:
-            workflow_tmp[input_name]["default"] = add_input_default(input_type, input_default)
-            process_tmp[input_name]["default"] = add_input_default(input_type, input_default)
-
-        process_inputs.append(process_tmp)
+            default_value = add_input_default(input_type, input_default)
+            workflow_input["default"] = default_value
+            process_input["default"] = default_value
 
         # Step inputs
-        step_tmp = {input_name: input_name}
-        step_inputs.append(step_tmp)
-
-    # Need to merge the lists of dicts to properly format output
-    workflow_inputs = {k: v for d in workflow_inputs for k, v in d.items()}
-    process_inputs = {k: v for d in process_inputs for k, v in d.items()}
-    step_inputs = {k: v for d in step_inputs for k, v in d.items()}
+        step_inputs[input_name] = input_name
 
     workflow["$graph"][0]["inputs"] = workflow_inputs
     workflow["$graph"][1]["inputs"] = process_inputs
@@ -222,29 +293,22 @@ def yaml_to_cwl(yaml_file, workflow_output_dir, template_file):
             logging.warning("Expected output name and output type to be specified.")
 
         # Workflow outputs
-        tmp = {output_name: {
+        workflow_outputs[output_name] = {
             "type": output_type,
             "outputSource": f"process/outputs_result"
-        }}
-        workflow_outputs.append(tmp)
+        }
 
         # Process outputs
-        tmp = {f"outputs_result" :{
+        process_outputs["outputs_result"] = {
             "outputBinding": {
                 "glob": f"./output*"
             },
             "type": output_type
-            }
         }
-        process_outputs.append(tmp)
 
         # Step outputs
         step_outputs.append("outputs_result")
 
-
-    workflow_outputs = {k: v for d in workflow_outputs for k, v in d.items()}
-    process_outputs = {k: v for d in process_outputs for k, v in d.items()}
-    
     workflow["$graph"][0]["outputs"] = workflow_outputs
     workflow["$graph"][1]["outputs"] = process_outputs
     workflow["$graph"][0]["steps"]["process"]["out"] = step_outputs
@@ -253,16 +317,16 @@ def yaml_to_cwl(yaml_file, workflow_output_dir, template_file):
     # that will not be in the YML input file
     workflow["s:dateCreated"] = date.today()
     workflow["s:softwareVersion"] = "1.0.0"
-    workflow["$graph"][1]["requirements"]["DockerRequirement"]["dockerPull"] = os.getenv('DOCKER_TAG')
+    workflow["$graph"][1]["requirements"]["DockerRequirement"]["dockerPull"] = docker_tag
 
     # Add information that is not required to be compliant with OGC and CWL best practices and is not in the YML input file,
     # yet is desired by MAAP.
-    workflow["s:commitHash"] = os.getenv('GIT_COMMIT_HASH')
+    workflow["s:commitHash"] = commit_hash
 
     # Dump data to workflow file
-    workflow_file = os.path.join(workflow_output_dir, os.getenv('WORKFLOW_FILE_NAME', 'process.cwl'))
-    with open(workflow_file, 'w') as f:
-        yaml.dump(workflow, f, default_flow_style=False, sort_keys=False)
+    workflow_file = os.path.join(workflow_output_dir, workflow_filename)
+    with open(workflow_file, 'wb', buffering=1 << 16) as f:
+        yaml.dump(workflow, f, Dumper=NoAliasDumper, encoding='utf-8', default_flow_style=False, sort_keys=False)
 
     print(f"CWL workflow saved to {workflow_file}")
 
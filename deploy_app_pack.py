@@ -3,13 +3,41 @@ Deploy application package
 '''
 import yaml
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import argparse
 import os
-import json
 import sys
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
-def submit_request(url, data, headers):
+try:
+    import orjson
+    from orjson import loads as json_loads
+
+    def json_dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+except ImportError:
+    import json
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+# Shared session so the fallback PUT reuses the connection opened by the POST. Retries on gateway errors use
+# urllib3's default allowed methods, which exclude POST since it is not idempotent, so only the PUT is retried.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=4,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504], raise_on_status=False)
+))
+
+
+def submit_request(url, body, headers):
     """
     Submit a request to the application package registry. A POST request is attempted first. If the response to the POST
     is an HTTP status code of 409, this indicates the process already exists then a PUT request will be submitted,
@@ -17,14 +45,14 @@ def submit_request(url, data, headers):
     
     Args:
         url (str): The registry URL.
-        data (dict): The request body, containing the process CWL URL or path.
+        body (bytes): The JSON-encoded request body, containing the process CWL URL or path.
         headers (dict): The request headers.
 
     Returns:
         bool: True if the request (POST or fallback PUT) completes successfully, False otherwise.
     """
     try:
-        response = requests.post(url, data=json.dumps(data), headers=headers)
+        response = _SESSION.post(url, data=body, headers=headers)
         print(response.text)
         response.raise_for_status()
         return True
@@ -32,21 +60,16 @@ def submit_request(url, data, headers):
     except requests.exceptions.HTTPError as e:
         if e.response.status_code == 409:
             try:
-                r = e.response.json()
+                r = json_loads(e.response.content)
                 print(r.get("detail", None))
 
                 process_id = r["additionalProperties"]["processID"]
-                url = f"{url}/{process_id}"
-
-                print("Submitting PUT request to modify existing process...")
-                response = requests.put(url, data=json.dumps(data), headers=headers)
-                response.raise_for_status()
-                print(f'Response: {response.text}')
-                return True
 
-            except (KeyError, requests.exceptions.RequestException, ValueError) as e:
+            except (KeyError, ValueError) as e:
                 print(f"Failed to submit request: {e}")
                 return False
+
+            return update_process(f"{url}/{process_id}", body, headers)
         else:
             print(f"HTTP error: {e}")
             return False
@@ -56,14 +79,55 @@ def submit_request(url, data, headers):
         return False
 
 
-def deploy_app_pack(process_cwl_url, app_pack_registry, template_file):
+def update_process(url, body, headers, missing_ok=False):
+    """
+    Submit a PUT request to the application package registry, overwriting an existing process.
+
+    Args:
+        url (str): The URL of the existing process in the registry.
+        body (bytes): The JSON-encoded request body, containing the process CWL URL or path.
+        headers (dict): The request headers.
+        missing_ok (bool): If True, a 404 response is not treated as a failure.
+
+    Returns:
+        bool or None: True if the PUT request completes successfully, None if `missing_ok` is set and the process
+            does not exist, False otherwise.
+    """
+    try:
+        print("Submitting PUT request to modify existing process...")
+        response = _SESSION.put(url, data=body, headers=headers)
+        response.raise_for_status()
+        print(f'Response: {response.text}')
+        return True
+
+    except requests.exceptions.HTTPError as e:
+        if missing_ok and e.response.status_code == 404:
+            print(f"Process not found at {url}.")
+            return None
+        print(f"Failed to submit request: {e}")
+        return False
+
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to submit request: {e}")
+        return False
+
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        return False
+
+
+def deploy_app_pack(process_cwl_url, app_pack_registry, template_file, process_id=None):
     """
-    Builds a request to deploy an application package process CWL to a specified registry.
+    Builds a request to deploy an application package process CWL to a specified registry. If the process ID is
+    known, the existing process is updated directly with a PUT request instead of attempting a POST first. If no
+    process exists with that ID, the request falls back to deploying as if the ID were unknown.
 
     Args:
         process_cwl_url (str): The URL or path to the process CWL.
         app_pack_register_endpoint (str): The URL of the application package registry to which the process will be deployed.
         template_file (str): The path to the YAML template file containing the deployment request.
+        process_id (str): The ID of an already deployed process to update. Defaults to the `MAAP_PROCESS_ID`
+            environment variable if not provided.
 
     Returns:
         None
@@ -71,8 +135,8 @@ def deploy_app_pack(process_cwl_url, app_pack_registry, template_file):
     Raises:
         ValueError: Raises a ValueError if the MAAP_PGT token is not set. This token is required to deploy processes.
     """
-    with open(template_file, 'r') as f:
-        data = yaml.safe_load(f)
+    with open(template_file, 'rb') as f:
+        data = yaml.load(f, Loader=SafeLoader)
 
     if data.get("executionUnit", {}).get("href"):
         data["executionUnit"]["href"] = process_cwl_url
@@ -86,7 +150,21 @@ def deploy_app_pack(process_cwl_url, app_pack_registry, template_file):
         'Content-Type': 'application/json'
     }
 
-    return submit_request(app_pack_registry, data, headers)
+    # Serialize once so the fallback PUT reuses the same body as the POST
+    try:
+        body = json_dumps(data)
+    except (TypeError, ValueError) as e:
+        print(f"Failed to serialize request body: {e}")
+        return False
+
+    process_id = process_id or os.getenv('MAAP_PROCESS_ID')
+    if process_id:
+        updated = update_process(f"{app_pack_registry}/{process_id}", body, headers, missing_ok=True)
+        if updated is not None:
+            return updated
+        print("Deploying process with a POST request instead...")
+
+    return submit_request(app_pack_registry, body, headers)
 
 
 if __name__ == "__main__":
@@ -94,6 +172,7 @@ if __name__ == "__main__":
     parser.add_argument("--process-cwl-url", type=str, help="URL or path to process CWL describing application package to deploy", required=True)
     parser.add_argument("--app-pack-register-endpoint", type=str, help="Application package registry to deploy application package to.")
     parser.add_argument("--app-pack-template-file", type=str, default="templates/ogcapppkg.yml", help="Path to the OGC API processes compliant OGC application package schema template.")
+    parser.add_argument("--process-id", type=str, help="ID of an already deployed process to update. If not provided, `MAAP_PROCESS_ID` is used if set, otherwise a new process is deployed.")
 
     args = parser.parse_args()
     print(f"Parameters: \n \
@@ -101,8 +180,8 @@ if __name__ == "__main__":
     Application package register endpoint: {args.app_pack_register_endpoint} \n \
     Template file: {args.app_pack_template_file}")
 
-    with open(args.app_pack_template_file, 'r') as f:
-        data = yaml.safe_load(f)
+    with open(args.app_pack_template_file, 'rb') as f:
+        data = yaml.load(f, Loader=SafeLoader)
         
-    if not deploy_app_pack(process_cwl_url=args.process_cwl_url, app_pack_registry=args.app_pack_register_endpoint, template_file=args.app_pack_template_file):
+    if not deploy_app_pack(process_cwl_url=args.process_cwl_url, app_pack_registry=args.app_pack_register_endpoint, template_file=args.app_pack_template_file, process_id=args.process_id):
         sys.exit(1)